@@ -23,6 +23,12 @@ class TokenManager:
         self._web_token_cache: Optional[str] = None
         self._web_token_timestamp: float = 0
         self._web_token_expiry: int = 30 * 60  # 30 minutes in seconds
+
+        # Auto mode: remember which method last succeeded so a known-failing
+        # long-lived lookup is not retried on every call
+        self._auto_last_ok: Optional[int] = None
+        self._auto_last_ok_ts: float = 0
+        self._auto_sticky_ttl: int = 5 * 60  # 5 minutes in seconds
         
         # Default credentials for web login
         self.default_user = "shushi"
@@ -53,18 +59,40 @@ class TokenManager:
         elif self.token_mode == TOKEN_MODE_AUTO:
             # Auto mode: prefer long-lived, fallback to oauth2
             self.logger.debug("Using auto token mode")
+            oauth2_tried = False
+            if (self._auto_last_ok == TOKEN_MODE_OAUTH2 and
+                (time.monotonic() - self._auto_last_ok_ts) < self._auto_sticky_ttl):
+                token = self.get_web_access_tokens(host, username, password)
+                if token:
+                    # Keep the original timestamp so the preferred long-lived token
+                    # is looked up again at least once per TTL
+                    self.logger.debug("Auto mode: using oauth2 token (last successful method)")
+                    return token
+                oauth2_tried = True
+
             token = self.get_long_lived_access_tokens()
             if token:
                 self.logger.info("Auto mode: using long-lived token")
+                self._set_auto_last_ok(TOKEN_MODE_LONGLIVED)
                 return token
-            else:
-                self.logger.info("Auto mode: long-lived token not available, trying oauth2")
-                return self.get_web_access_tokens(host, username, password)
+            if oauth2_tried:
+                self._set_auto_last_ok(None)
+                return None
+
+            self.logger.info("Auto mode: long-lived token not available, trying oauth2")
+            token = self.get_web_access_tokens(host, username, password)
+            self._set_auto_last_ok(TOKEN_MODE_OAUTH2 if token else None)
+            return token
         
         else:
             self.logger.error(f"Unknown token mode: {self.token_mode}")
             return None
 
+    def _set_auto_last_ok(self, mode: Optional[int]):
+        """Record the token method that last succeeded in auto mode"""
+        self._auto_last_ok = mode
+        self._auto_last_ok_ts = time.monotonic() if mode is not None else 0
+
     def get_long_lived_access_tokens(self) -> Optional[str]:
         """
         Get long-lived access tokens from configuration file
@@ -74,24 +102,28 @@ class TokenManager:
             if not os.path.exists(self.config_file):
                 self.logger.error(f"Configuration file not found: {self.config_file}")
                 return None
-            with open(self.config_file, 'r') as f:
-                config_content = f.read()
-            lines = config_content.split('\n')
+            # The config file is tiny; a single raw read avoids the buffered text-IO setup
+            fd = os.open(self.config_file, os.O_RDONLY)
+            try:
+                data = os.read(fd, 4096)
+            finally:
+                os.close(fd)
+            lines = data.splitlines()
             for line in lines:
                 line = line.strip()
                 if not line:
                     continue
-                if line.startswith('token=') or line.startswith('access_token='):
-                    token = line.split('=', 1)[1].strip()
+                if line.startswith(b'token=') or line.startswith(b'access_token='):
+                    token = line.split(b'=', 1)[1].strip()
                     if token:
                         self.logger.info("Successfully retrieved long-lived access token (with prefix)")
-                        return token
+                        return token.decode('utf-8')
             # 如果没有前缀，直接取第一行非空内容
             for line in lines:
                 line = line.strip()
                 if line:
                     self.logger.info("Successfully retrieved long-lived access token (no prefix)")
-                    return line
+                    return line.decode('utf-8')
             self.logger.warning("No token found in configuration file")
             return None
         except Exception as e:
@@ -4,10 +4,12 @@ import os
 import time
 import logging
 import subprocess
-import glob
 import tempfile
+import tarfile
 import shutil
+import stat
 import json
+import re
 import fnmatch
 from datetime import datetime
 from .wifi_utils import get_current_wifi_info
@@ -17,22 +19,34 @@ from .util import force_sync
 from ..const import BACKUP_STORAGE_MODE, BACKUP_INTERNAL_PATH, BACKUP_EXTERNAL_PATH
 from supervisor.sysinfo import SystemInfoUpdater
 import sqlite3
-
-SERVICES_TO_MANAGE = [
+try:
+    import dbus
+except Exception:
+    dbus = None
+try:
+    import ctypes
+    _LIBC = ctypes.CDLL(None, use_errno=True)
+except Exception:
+    _LIBC = None
+
+SERVICES_TO_MANAGE = (
     "home-assistant.service",
     "matter-server.service",
     "otbr-agent.service",
     "zigbee2mqtt.service",
     "mosquitto.service",
     "openhab.service"
-]
+)
 
-BACKUP_DIRS_CONFIG = [
+BACKUP_DIRS_CONFIG = (
     ("/var/lib/thread", "thread_data"),
     ("/var/lib/homeassistant", "homeassistant_data"),
     ("/opt/zigbee2mqtt/data", "zigbee2mqtt_data"),
     ("/etc/mosquitto", "mosquitto_config")
-]
+)
+
+# Restore targets derived from BACKUP_DIRS_CONFIG, normalized once
+RESTORE_TARGETS = tuple((os.path.normpath(path), name) for path, name in BACKUP_DIRS_CONFIG)
 
 # Files and directories to exclude from backup (patterns)
 BACKUP_EXCLUDE_PATTERNS = [
@@ -58,100 +72,147 @@ BACKUP_EXCLUDE_PATTERNS = [
 # Configuration directory for restore records
 RESTORE_RECORD_DIR = "/usr/lib/thirdreality/conf"
 
+# Fields run_setting_update_z2m_mqtt requires in its config
+Z2M_MQTT_REQUIRED_KEYS = ("base_topic", "server", "user", "password", "client_id")
+
+# History tables left empty in the backup copy of a large Home Assistant database
+HA_DB_PURGE_TABLES = ("events", "states", "statistics", "statistics_short_term")
+
+# gzip level for backup archives (level 3 is about twice as fast as the default 6 for a few % larger files)
+BACKUP_GZIP_LEVEL = 3
+# tar record size in 512-byte blocks: 2048 makes tar write 1 MiB at a time instead of 10 KiB
+BACKUP_TAR_BLOCKING_FACTOR = 2048
+
+# Resolve helper binaries once so each subprocess skips the PATH lookup
+_SYSTEMCTL = shutil.which("systemctl") or "/bin/systemctl"
+_TAR = shutil.which("tar") or "/bin/tar"
+# Parallel gzip (pigz) output is gzip-compatible; use it for backup archives when installed
+_PIGZ = shutil.which("pigz")
+# Archive members are validated before extraction; keep full metadata on Pythons with extraction filters
+_TAR_EXTRACT_KWARGS = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+
 logger = logging.getLogger("Supervisor")
 
+_EXCLUDE_REGEX_CACHE = {}
+
+def _compile_exclude_patterns(exclude_patterns):
+    """
+    Compile exclude patterns into (name_re, dir_re), cached per pattern list.
+    name_re matches a file name or relative path against any glob pattern;
+    dir_re finds a directory pattern ('name/') as a whole path component.
+    """
+    key = tuple(exclude_patterns)
+    compiled = _EXCLUDE_REGEX_CACHE.get(key)
+    if compiled is None:
+        name_re = re.compile("|".join(fnmatch.translate(p) for p in key) or r"(?!)")
+        dir_names = [re.escape(p.rstrip('/')) for p in key if p.endswith('/')]
+        dir_re = re.compile(r"(?:^|/)(?:%s)(?:/|$)" % "|".join(dir_names)) if dir_names else None
+        compiled = _EXCLUDE_REGEX_CACHE[key] = (name_re, dir_re)
+    return compiled
+
 def _should_exclude_file(file_path, exclude_patterns):
     """
     Check if a file should be excluded from backup
     """
-    file_name = os.path.basename(file_path)
-    rel_path = file_path
-    
-    for pattern in exclude_patterns:
-        # Check filename match
-        if fnmatch.fnmatch(file_name, pattern):
-            return True
-        # Check relative path match
-        if fnmatch.fnmatch(rel_path, pattern):
-            return True
-        # Check if path contains directory pattern
-        if pattern.endswith('/') and ('/' + pattern.rstrip('/') + '/') in ('/' + rel_path + '/'):
-            return True
-    
-    return False
+    name_re, dir_re = _compile_exclude_patterns(exclude_patterns)
+    # Check filename match, then relative path match
+    if name_re.match(os.path.basename(file_path)) or name_re.match(file_path):
+        return True
+    # Check if path contains directory pattern
+    return bool(dir_re and dir_re.search(file_path))
 
-def _clean_directory_for_backup(source_dir, dest_dir, exclude_patterns):
+def _collect_backup_members(source_path, exclude_patterns):
     """
-    Copy directory contents to destination while excluding unwanted files
-    Returns the number of cleaned files and their size
+    Walk source_path and collect the paths to archive, excluding unwanted files.
+    Directories are listed individually so tar can run with --no-recursion;
+    symlinks (including symlinked directories) are listed but not followed.
+    The sizes of the included files are summed from the same walk for the
+    preflight space check.
+    Returns (members, included_size, excluded_files_count, excluded_size)
     """
-    cleaned_files_count = 0
-    cleaned_size = 0
-    
-    if not os.path.exists(source_dir):
-        return cleaned_files_count, cleaned_size
-    
-    for root, dirs, files in os.walk(source_dir):
-        # Calculate path relative to source directory
-        rel_root = os.path.relpath(root, source_dir)
-        if rel_root == '.':
-            rel_root = ''
-        
-        # Check if directories should be excluded
-        dirs_to_remove = []
-        for dir_name in dirs:
-            rel_dir_path = os.path.join(rel_root, dir_name) if rel_root else dir_name
-            if _should_exclude_file(rel_dir_path + '/', exclude_patterns):
-                dirs_to_remove.append(dir_name)
-                logger.info(f"Excluding directory from backup: {rel_dir_path}/")
-        
-        # Remove excluded directories from dirs list so os.walk won't traverse them
-        for dir_name in dirs_to_remove:
-            dirs.remove(dir_name)
-        
-        # Create target directory structure
-        target_root = os.path.join(dest_dir, rel_root) if rel_root else dest_dir
-        if not os.path.exists(target_root):
-            os.makedirs(target_root, exist_ok=True)
-        
-        # Process files
-        for file_name in files:
-            rel_file_path = os.path.join(rel_root, file_name) if rel_root else file_name
-            source_file = os.path.join(root, file_name)
-            
-            if _should_exclude_file(rel_file_path, exclude_patterns):
+    members = []
+    included_size = 0
+    excluded_files_count = 0
+    excluded_size = 0
+
+    if os.path.isfile(source_path):
+        if _should_exclude_file(os.path.basename(source_path), exclude_patterns):
+            try:
+                excluded_size += os.path.getsize(source_path)
+                excluded_files_count += 1
+                logger.info(f"File {source_path} excluded from backup")
+            except OSError:
+                pass
+        else:
+            members.append(source_path)
+            try:
+                included_size += os.path.getsize(source_path)
+            except OSError:
+                pass
+        return members, included_size, excluded_files_count, excluded_size
+
+    if not os.path.isdir(source_path):
+        return members, included_size, excluded_files_count, excluded_size
+
+    members.append(source_path)
+    # Stack of (directory, path relative to source_path with trailing '/');
+    # DirEntry carries the file type, so no extra stat is needed per entry
+    pending = [(source_path, "")]
+    while pending:
+        dir_path, rel_prefix = pending.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Cannot read directory {dir_path}: {e}")
+            continue
+
+        for entry in entries:
+            rel_path = rel_prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if _should_exclude_file(rel_path + '/', exclude_patterns):
+                    logger.info(f"Excluding directory from backup: {rel_path}/")
+                    continue
+                members.append(entry.path)
+                pending.append((entry.path, rel_path + '/'))
+                continue
+
+            if _should_exclude_file(rel_path, exclude_patterns):
                 # Calculate size of excluded files
                 try:
-                    file_size = os.path.getsize(source_file)
-                    cleaned_size += file_size
-                    cleaned_files_count += 1
-                    logger.info(f"Excluding file from backup: {rel_file_path} ({file_size} bytes)")
+                    file_size = entry.stat(follow_symlinks=False).st_size
+                    excluded_size += file_size
+                    excluded_files_count += 1
+                    logger.info(f"Excluding file from backup: {rel_path} ({file_size} bytes)")
                 except OSError:
                     pass
             else:
-                # Copy file
-                target_file = os.path.join(target_root, file_name)
+                members.append(entry.path)
                 try:
-                    shutil.copy2(source_file, target_file)
-                except Exception as e:
-                    logger.warning(f"Failed to copy file {source_file} to {target_file}: {e}")
-    
-    return cleaned_files_count, cleaned_size
+                    included_size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+
+    return members, included_size, excluded_files_count, excluded_size
+
+def _tar_rename_expression(source_path, name):
+    """
+    Build a GNU tar --transform expression that renames the archive prefix of
+    source_path (archived relative to /) to name. Symlink targets are left alone.
+    """
+    prefix = "".join("\\" + c if c in ".[]*^$\\," else c for c in source_path.strip("/"))
+    return f"--transform=s,^{prefix}\\(/\\|$\\),{name}\\1,S"
 
 def _check_external_storage_available():
     """
     Check if external storage (USB) is mounted at /mnt
     """
     try:
-        result = subprocess.run(["mount"], capture_output=True, text=True)
-        if result.returncode == 0:
-            # Check if there's any mount point under /mnt
-            for line in result.stdout.splitlines():
-                if "/mnt" in line:
-                    return True
-        return False
+        # Field 5 of each mountinfo line is the mount point; no need to fork `mount`
+        with open("/proc/self/mountinfo") as f:
+            return any(line.split()[4].startswith("/mnt") for line in f)
     except Exception as e:
-        logging.error(f"Failed to check mount status: {e}")
+        logger.error(f"Failed to check mount status: {e}")
         return False
 
 def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_callback=None):
@@ -177,8 +238,7 @@ def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_c
     try:
         _call_progress(0, "Validating parameters")
 
-        required_keys = ["base_topic", "server", "user", "password", "client_id"]
-        missing = [k for k in required_keys if not config.get(k)]
+        missing = [k for k in Z2M_MQTT_REQUIRED_KEYS if not config.get(k)]
         if missing:
             msg = f"Missing required fields: {','.join(missing)}"
             logger.error(msg)
@@ -192,7 +252,7 @@ def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_c
         # 停止服务
         _call_progress(10, "Stopping zigbee2mqtt service...")
         try:
-            subprocess.run(["systemctl", "stop", "zigbee2mqtt.service"], check=False)
+            _stop_services(("zigbee2mqtt.service",))
         except Exception as e:
             logger.warning(f"Failed to stop zigbee2mqtt: {e}")
 
@@ -211,7 +271,7 @@ def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_c
         _call_progress(30, "Backing up existing configuration if present")
         try:
             if os.path.exists(config_path):
-                ts = datetime.now().strftime("%Y%m%d%H%M%S")
+                ts = time.strftime("%Y%m%d%H%M%S")
                 shutil.copy2(config_path, f"{config_path}.{ts}.bak")
         except Exception as e:
             logger.warning(f"Failed to backup existing configuration: {e}")
@@ -356,8 +416,8 @@ def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_c
         # 启动服务
         _call_progress(90, "Starting zigbee2mqtt service...")
         try:
-            subprocess.run(["systemctl", "enable", "zigbee2mqtt.service"], check=False)
-            subprocess.run(["systemctl", "start", "zigbee2mqtt.service"], check=False)
+            _set_services_enabled(("zigbee2mqtt.service",), True)
+            _start_services(("zigbee2mqtt.service",))
         except Exception as e:
             logger.warning(f"Failed to start zigbee2mqtt: {e}")
 
@@ -369,9 +429,6 @@ def run_setting_update_z2m_mqtt(config: dict, progress_callback=None, complete_c
         logger.error(msg, exc_info=True)
         if complete_callback:
             complete_callback(False, msg)
-    except Exception as e:
-        logging.error(f"Failed to check mount status: {e}")
-        return False
 
 def _get_backup_path():
     """
@@ -386,49 +443,555 @@ def _get_backup_path():
     else:
         raise Exception(f"Invalid backup storage mode: {BACKUP_STORAGE_MODE}")
 
-def _estimate_backup_size_bytes(paths_with_names, exclude_patterns):
+# systemd D-Bus API, used instead of forking systemctl when dbus-python is available
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_OBJECT_PATH = "/org/freedesktop/systemd1"
+SYSTEMD_MANAGER_IFACE = "org.freedesktop.systemd1.Manager"
+SYSTEMD_UNIT_IFACE = "org.freedesktop.systemd1.Unit"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+# Unit file states for which `systemctl is-enabled` exits 0
+SYSTEMD_ENABLED_STATES = ("enabled", "enabled-runtime", "static", "alias", "indirect", "generated", "transient")
+SYSTEMD_JOB_TIMEOUT = 120  # seconds to wait for queued start/stop jobs
+# Properties requested from `systemctl show` in the systemctl fallback
+_SYSTEMD_SHOW_RE = re.compile(r"^(ActiveState|UnitFileState)=(.*)$", re.M)
+
+def _connect_systemd():
     """
-    Estimate total bytes needed for backup by summing files to include (after exclusions).
-    Args:
-        paths_with_names: list of tuples (src_path, name)
-        exclude_patterns: list of exclude patterns
-    Returns:
-        int total_bytes
+    Connect to the systemd manager on the system bus.
+    Returns (bus, manager) or None if D-Bus is unavailable.
     """
-    total_bytes = 0
+    if dbus is None:
+        return None
     try:
-        for src_path, _name in paths_with_names:
-            if not os.path.exists(src_path):
-                continue
-            if os.path.isfile(src_path):
-                # Single file
-                file_name = os.path.basename(src_path)
-                if not _should_exclude_file(file_name, exclude_patterns):
-                    try:
-                        total_bytes += os.path.getsize(src_path)
-                    except Exception:
-                        pass
+        # Private connection: a shared one would be handed back again after it dropped
+        bus = dbus.SystemBus(private=True)
+        manager = dbus.Interface(bus.get_object(SYSTEMD_BUS_NAME, SYSTEMD_OBJECT_PATH), SYSTEMD_MANAGER_IFACE)
+        return bus, manager
+    except Exception as e:
+        logger.warning(f"Failed to connect to systemd over D-Bus, falling back to systemctl: {e}")
+        return None
+
+# Cached (bus, manager) pair, connected on first use and dropped on failure
+_SYSTEMD = None
+
+def _get_systemd():
+    """
+    Return the cached (bus, manager) pair, connecting first if needed.
+    Returns None if D-Bus is unavailable.
+    """
+    global _SYSTEMD
+    if _SYSTEMD is None:
+        _SYSTEMD = _connect_systemd()
+    return _SYSTEMD
+
+def _reset_systemd():
+    """
+    Drop the cached systemd connection so the next call reconnects.
+    """
+    global _SYSTEMD
+    if _SYSTEMD is not None:
+        try:
+            _SYSTEMD[0].close()
+        except Exception:
+            pass
+    _SYSTEMD = None
+
+def _systemd_active_state(bus, manager, service):
+    unit = bus.get_object(SYSTEMD_BUS_NAME, manager.LoadUnit(service))
+    return str(unit.Get(SYSTEMD_UNIT_IFACE, "ActiveState", dbus_interface=DBUS_PROP_IFACE))
+
+def _systemd_wait_jobs(manager, job_paths, timeout=SYSTEMD_JOB_TIMEOUT):
+    """
+    Wait until the given systemd jobs have left the job queue.
+    Returns True if all jobs finished within timeout.
+    """
+    pending = set(job_paths)
+    deadline = time.monotonic() + timeout
+    while pending:
+        pending &= {str(job[4]) for job in manager.ListJobs()}
+        if not pending:
+            break
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+def _systemd_run_jobs(manager, method, services, wait=True):
+    """
+    Queue a StartUnit/StopUnit job for every service and, if wait is set, wait for all of them.
+    Returns the list of services whose job could not be queued.
+    """
+    job_paths = []
+    failed = []
+    for service in services:
+        try:
+            job_paths.append(str(getattr(manager, method)(service, "replace")))
+        except dbus.exceptions.DBusException as e:
+            logger.warning(f"{method} failed for {service}: {e.get_dbus_message()}")
+            failed.append(service)
+    if wait and not _systemd_wait_jobs(manager, job_paths):
+        logger.warning(f"Timed out waiting for {method} jobs of {', '.join(services)}")
+    return failed
+
+def _query_service_states(services):
+    """
+    Return {service: {"active": bool, "enabled": bool}} for the given systemd units.
+    Uses the systemd D-Bus API when available; otherwise both states are read with
+    a single `systemctl show` call.
+    """
+    states = {service: {"active": False, "enabled": False} for service in services}
+    if not services:
+        return states
+    systemd = _get_systemd()
+    if systemd is not None:
+        bus, manager = systemd
+        try:
+            for service in services:
+                states[service]["active"] = _systemd_active_state(bus, manager, service) == "active"
+                try:
+                    states[service]["enabled"] = str(manager.GetUnitFileState(service)) in SYSTEMD_ENABLED_STATES
+                except dbus.exceptions.DBusException:
+                    # No unit file installed for this service
+                    states[service]["enabled"] = False
+            return states
+        except Exception as e:
+            _reset_systemd()
+            logger.warning(f"systemd D-Bus query failed: {e}. Falling back to systemctl.")
+    try:
+        result = subprocess.run([_SYSTEMCTL, "show", "--property=ActiveState", "--property=UnitFileState", "--", *services],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        # One blank-line separated record per unit, in the order the units were given
+        for service, record in zip(services, result.stdout.split("\n\n")):
+            properties = dict(_SYSTEMD_SHOW_RE.findall(record))
+            states[service]["active"] = properties.get("ActiveState") == "active"
+            states[service]["enabled"] = properties.get("UnitFileState") in SYSTEMD_ENABLED_STATES
+    except Exception as e:
+        logger.warning(f"Could not determine state of services: {e}. Assuming inactive and disabled.")
+    return states
+
+def _stop_services(services):
+    """
+    Stop the given systemd units with a single systemctl invocation.
+    """
+    if not services:
+        return
+    service_list = ", ".join(services)
+    systemd = _get_systemd()
+    if systemd is not None:
+        _, manager = systemd
+        try:
+            logger.info(f"Stopping services over D-Bus: {service_list}")
+            _systemd_run_jobs(manager, "StopUnit", services)
+            logger.info(f"Services stopped or were not running: {service_list}")
+            return
+        except Exception as e:
+            _reset_systemd()
+            logger.warning(f"systemd D-Bus stop failed: {e}. Falling back to systemctl.")
+    try:
+        logger.info(f"Stopping services: {service_list}")
+        stop_result = subprocess.run([_SYSTEMCTL, "stop", *services], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        # systemctl stop returns 5 if a unit was not loaded, which is fine.
+        if stop_result.returncode == 0 or stop_result.returncode == 5:
+            logger.info(f"Services stopped or were not running: {service_list}")
+        else:
+            logger.warning(f"Failed to stop some services ({service_list}). RC: {stop_result.returncode}. Error: {stop_result.stderr.strip()}. Proceeding.")
+    except Exception as e:
+        logger.warning(f"Error stopping services {service_list}: {e}. Proceeding.")
+
+def _start_services(services):
+    """
+    Start the given systemd units with a single systemctl invocation.
+    The start jobs are only queued (like `systemctl --no-block`); nothing after a
+    start depends on the services having finished activating.
+    """
+    if not services:
+        return
+    service_list = ", ".join(services)
+    systemd = _get_systemd()
+    if systemd is not None:
+        _, manager = systemd
+        try:
+            logger.info(f"Starting services over D-Bus: {service_list}")
+            failed = _systemd_run_jobs(manager, "StartUnit", services, wait=False)
+            if failed:
+                logger.warning(f"Failed to start some services: {', '.join(failed)}")
             else:
-                # Directory walk
-                for root, dirs, files in os.walk(src_path):
-                    rel_root = os.path.relpath(root, src_path)
-                    if rel_root == '.':
-                        rel_root = ''
-                    # Exclude directories
-                    dirs[:] = [d for d in dirs if not _should_exclude_file(os.path.join(rel_root, d) + '/', exclude_patterns)]
-                    for file_name in files:
-                        rel_file_path = os.path.join(rel_root, file_name) if rel_root else file_name
-                        if _should_exclude_file(rel_file_path, exclude_patterns):
-                            continue
-                        file_path = os.path.join(root, file_name)
+                logger.info(f"Start jobs queued for services: {service_list}")
+            return
+        except Exception as e:
+            _reset_systemd()
+            logger.warning(f"systemd D-Bus start failed: {e}. Falling back to systemctl.")
+    try:
+        logger.info(f"Starting services: {service_list}")
+        start_result = subprocess.run([_SYSTEMCTL, "--no-block", "start", *services], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if start_result.returncode == 0:
+            logger.info(f"Start jobs queued for services: {service_list}")
+        else:
+            logger.warning(f"Failed to start some services ({service_list}). RC: {start_result.returncode}. Error: {start_result.stderr.strip()}")
+    except Exception as e:
+        logger.error(f"Unexpected error starting services {service_list}: {e}")
+
+def _set_services_enabled(services, enabled, now=False):
+    """
+    Enable or disable the given systemd units with a single call, over the systemd
+    D-Bus API when available and through systemctl otherwise. With now=True the
+    units are also started or stopped in the same call (`systemctl --now`); start
+    jobs are only queued, as in _start_services.
+    systemd rejects the whole batch if one unit file is missing, so a failed batch
+    is retried one unit at a time to apply the rest and report the failing units.
+    """
+    if not services:
+        return
+    verb = "enable" if enabled else "disable"
+    service_list = ", ".join(services)
+    systemd = _get_systemd()
+    if systemd is not None:
+        _, manager = systemd
+        try:
+            logger.info(f"Running {verb} over D-Bus for: {service_list}")
+
+            def _apply(units):
+                # Returns the list of (type, file, destination) symlink changes made
+                if enabled:
+                    _, unit_changes = manager.EnableUnitFiles(units, False, False)
+                else:
+                    unit_changes = manager.DisableUnitFiles(units, False)
+                return list(unit_changes)
+
+            failed = []
+            changes = []
+            try:
+                changes = _apply(list(services))
+            except dbus.exceptions.DBusException as e:
+                logger.warning(f"Failed to {verb} services ({service_list}): {e.get_dbus_message()}")
+                if len(services) == 1:
+                    failed = list(services)
+                else:
+                    for service in services:
                         try:
-                            total_bytes += os.path.getsize(file_path)
-                        except Exception:
-                            pass
+                            changes += _apply([service])
+                        except dbus.exceptions.DBusException as e_one:
+                            logger.warning(f"Failed to {verb} service {service}: {e_one.get_dbus_message()}")
+                            failed.append(service)
+            # Like systemctl, reload the manager once so it picks up the changed unit
+            # files; a daemon-reload is expensive, so skip it when nothing changed
+            if changes:
+                manager.Reload()
+            if now:
+                applied = [service for service in services if service not in failed]
+                failed += _systemd_run_jobs(manager, "StartUnit" if enabled else "StopUnit", applied, wait=not enabled)
+            if failed:
+                logger.warning(f"Failed to {verb} some services: {', '.join(failed)}")
+            else:
+                logger.info(f"Services {verb}d successfully: {service_list}")
+            return
+        except Exception as e:
+            _reset_systemd()
+            logger.warning(f"systemd D-Bus {verb} failed: {e}. Falling back to systemctl.")
+    command = [_SYSTEMCTL, verb]
+    if now:
+        # Start jobs are queued without waiting; stops still wait
+        command += ["--now", "--no-block"] if enabled else ["--now"]
+    try:
+        logger.info(f"Running {' '.join(command[1:])} for: {service_list}")
+        result = subprocess.run([*command, *services], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0:
+            logger.info(f"Services {verb}d successfully: {service_list}")
+            return
+        logger.warning(f"Failed to {verb} services ({service_list}). RC: {result.returncode}. Error: {result.stderr.strip()}")
+        if len(services) == 1:
+            return
+        for service in services:
+            result = subprocess.run([*command, service], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if result.returncode == 0:
+                logger.info(f"Service {service} {verb}d successfully.")
+            else:
+                logger.warning(f"Failed to {verb} service {service}. RC: {result.returncode}. Error: {result.stderr.strip()}")
+    except Exception as e:
+        logger.error(f"Unexpected error running {' '.join(command[1:])} for {service_list}: {e}")
+
+def _list_backup_files(backup_base_path):
+    """
+    List setting_*.tar.gz backups in backup_base_path as (mtime, path) tuples.
+    A single scandir pass reuses each DirEntry's stat instead of glob + getmtime; scanning
+    through a directory fd makes those stats fstatat() calls relative to the open directory.
+    """
+    try:
+        dir_fd = os.open(backup_base_path, os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        return []
+    try:
+        with os.scandir(dir_fd) as it:
+            return [(e.stat(follow_symlinks=False).st_mtime, os.path.join(backup_base_path, e.name)) for e in it
+                    if e.is_file(follow_symlinks=False) and e.name.startswith("setting_") and e.name.endswith(".tar.gz")]
+    finally:
+        os.close(dir_fd)
+
+def _existing_paths(paths):
+    """
+    Return the set of paths that exist, listing each parent directory only once
+    instead of stat()ing every path.
+    """
+    names_by_parent = {}
+    for path in paths:
+        parent, name = os.path.split(os.path.normpath(path))
+        names_by_parent.setdefault(parent, []).append((name, path))
+    existing = set()
+    for parent, names in names_by_parent.items():
+        try:
+            entries = set(os.listdir(parent))
+        except OSError:
+            continue
+        existing.update(path for name, path in names if name in entries)
+    return existing
+
+def _remove_path(path):
+    """
+    Remove a file, symlink or directory tree if it exists.
+    """
+    try:
+        if stat.S_ISDIR(os.lstat(path).st_mode):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _extract_backup_archive(archive_path):
+    """
+    Stream the backup archive once with tarfile. Data directories are extracted next to
+    their targets as <target>.restore (same filesystem, ready for an os.rename swap) and
+    the small state files are returned in memory. Entries with absolute paths or '..'
+    components abort the extraction; top-level names that are not restore targets are skipped.
+    Returns (staged_targets, sidecars): a list of (target_sys_path, staging_path) and a
+    dict of state file name -> bytes.
+    """
+    staging_by_name = {}
+    for target_sys_path, mapped_name in RESTORE_TARGETS:
+        staging_path = target_sys_path + ".restore"
+        # Leftovers from an interrupted restore
+        _remove_path(staging_path)
+        backup_path = target_sys_path + ".bak"
+        if os.path.lexists(backup_path) and not os.path.lexists(target_sys_path):
+            # The swap was interrupted after the target was moved aside: .bak is the only copy
+            logger.warning(f"Putting back {backup_path} left by an interrupted restore.")
+            os.rename(backup_path, target_sys_path)
+        else:
+            _remove_path(backup_path)
+        staging_by_name[mapped_name] = (target_sys_path, staging_path)
+
+    def _resolve(member_name):
+        name = member_name[2:] if member_name.startswith("./") else member_name
+        name = name.rstrip("/")
+        if member_name.startswith("/") or ".." in name.split("/"):
+            raise Exception(f"Unexpected entry in backup archive {archive_path}: {member_name}")
+        # Collapse '.' and duplicate '/' so the symlink check below sees canonical names
+        name = os.path.normpath(name) if name else name
+        return name, name.split("/")[0]
+
+    # Staging names of symlinks extracted so far. Extraction runs as root with full
+    # metadata, so a later member at or below one of them would be written through
+    # the link, possibly outside the restore targets; such archives are rejected.
+    symlink_names = set()
+
+    def _through_symlink(path):
+        parts = path.split("/")
+        return any("/".join(parts[:i]) in symlink_names for i in range(1, len(parts) + 1))
+
+    sidecars = {}
+    staged_names = set()
+    skipped_names = set()
+    try:
+        # Read the archive and copy member data in 1 MiB chunks instead of the 10/16 KiB defaults
+        with tarfile.open(archive_path, "r|gz", bufsize=1 << 20, copybufsize=1 << 20) as tf:
+            for member in tf:
+                name, top_level = _resolve(member.name)
+                if not name or name == ".":
+                    continue
+                if name in ("service_states.json", "network_states.json") and member.isfile():
+                    with tf.extractfile(member) as sidecar_file:
+                        sidecars[name] = sidecar_file.read()
+                    continue
+                if top_level not in staging_by_name:
+                    # Not restored by this version (e.g. written by an older backup layout); skip without touching disk
+                    if top_level not in skipped_names:
+                        skipped_names.add(top_level)
+                        logger.warning(f"Skipping unknown entry in backup archive: {top_level}")
+                    continue
+                if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                    logger.warning(f"Skipping special file in backup archive: {member.name}")
+                    continue
+                member.name = staging_by_name[top_level][1].lstrip("/") + name[len(top_level):]
+                if _through_symlink(member.name):
+                    raise Exception(f"Backup archive entry {name} would be written through a symlink: {archive_path}")
+                if member.islnk():
+                    # Hard links point at archive names; redirect them into the staging tree too
+                    link_name, link_top_level = _resolve(member.linkname)
+                    if link_top_level not in staging_by_name:
+                        raise Exception(f"Unexpected link target in backup archive {archive_path}: {member.linkname}")
+                    member.linkname = staging_by_name[link_top_level][1].lstrip("/") + link_name[len(link_top_level):]
+                    if _through_symlink(member.linkname):
+                        raise Exception(f"Backup archive hard link {name} points through a symlink: {archive_path}")
+                tf.extract(member, "/", **_TAR_EXTRACT_KWARGS)
+                if member.issym():
+                    symlink_names.add(member.name)
+                staged_names.add(top_level)
+    except Exception:
+        for _, staging_path in staging_by_name.values():
+            _remove_path(staging_path)
+        raise
+
+    staged_targets = []
+    for _, mapped_name in RESTORE_TARGETS:
+        if mapped_name in staged_names:
+            staged_targets.append(staging_by_name[mapped_name])
+        else:
+            logger.warning(f"{mapped_name} not found in backup archive. Skipping restore for {staging_by_name[mapped_name][0]}.")
+    return staged_targets, sidecars
+
+def _fsync_path(path):
+    """
+    fsync a single file or directory by path.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_purged_db_copy(src_path, dst_path, purge_tables=HA_DB_PURGE_TABLES):
+    """
+    Write a compact copy of the SQLite database at src_path to dst_path with the
+    purge_tables left empty. The source is attached read-only and only the kept
+    rows are written, once, instead of copying the whole file and then running
+    DELETE and VACUUM on the copy. Indexes are created after the data is loaded.
+    """
+    conn = sqlite3.connect(dst_path, timeout=30, uri=True, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{src_path}?mode=ro",))
+        page_size, = conn.execute("PRAGMA src.page_size").fetchone()
+        auto_vacuum, = conn.execute("PRAGMA src.auto_vacuum").fetchone()
+        user_version, = conn.execute("PRAGMA src.user_version").fetchone()
+        journal_mode, = conn.execute("PRAGMA src.journal_mode").fetchone()
+        conn.execute(f"PRAGMA main.page_size={int(page_size)}")
+        conn.execute(f"PRAGMA main.auto_vacuum={int(auto_vacuum)}")
+        # The copy is throwaway until tar has read it: skip fsyncs, sort index
+        # builds in memory and give the rebuild a ~20MB page cache
+        conn.execute("PRAGMA main.synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA main.cache_size=-20000")
+
+        schema = conn.execute(
+            "SELECT type, name, sql FROM src.sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'").fetchall()
+        tables = [(name, sql) for obj_type, name, sql in schema if obj_type == "table"]
+        others = [sql for obj_type, name, sql in schema if obj_type != "table"]
+
+        conn.execute("BEGIN")
+        for name, sql in tables:
+            conn.execute(sql)
+        for name, _sql in tables:
+            if name in purge_tables:
+                continue
+            quoted = '"' + name.replace('"', '""') + '"'
+            conn.execute(f"INSERT INTO main.{quoted} SELECT * FROM src.{quoted}")
+        # AUTOINCREMENT counters are kept for purged tables too, as DELETE would. The inserts
+        # above already created rows for kept tables, so replace them with the source rows
+        has_sequence = conn.execute("SELECT 1 FROM src.sqlite_master WHERE name = 'sqlite_sequence'").fetchone()
+        if has_sequence:
+            conn.execute("DELETE FROM main.sqlite_sequence")
+            conn.execute("INSERT INTO main.sqlite_sequence SELECT * FROM src.sqlite_sequence")
+        for sql in others:
+            conn.execute(sql)
+        conn.execute(f"PRAGMA main.user_version={int(user_version)}")
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE src")
+        if str(journal_mode).lower() == "wal":
+            conn.execute("PRAGMA main.journal_mode=WAL")
+    finally:
+        conn.close()
+
+def _sync_filesystems(paths):
+    """
+    Flush the filesystems holding paths with syncfs(2), once per filesystem, instead of
+    a system-wide sync that also waits on unrelated mounts. Falls back to force_sync()
+    when syncfs is not available or fails.
+    """
+    syncfs = getattr(_LIBC, "syncfs", None)
+    if syncfs is None:
+        force_sync()
+        return
+    synced_devices = set()
+    try:
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                device = os.fstat(fd).st_dev
+                if device in synced_devices:
+                    continue
+                if syncfs(fd) != 0:
+                    raise OSError(ctypes.get_errno(), f"syncfs failed for {path}")
+                synced_devices.add(device)
+            finally:
+                os.close(fd)
+    except Exception as e:
+        logger.warning(f"syncfs failed ({e}); falling back to full sync")
+        force_sync()
+
+def _create_backup_archive(member_args, archive_path):
+    """
+    Create a gzip-compressed tarball at archive_path; member_args are the tar
+    arguments selecting the members (-C/-T/--transform ...).
+    tar output is streamed straight into pigz when available. The archive is written
+    to a .tmp file and only renamed into place once every stage succeeded, so an
+    interrupted backup never leaves a truncated setting_*.tar.gz behind. The archive
+    and its directory are fsynced, so no filesystem-wide sync is needed afterwards.
+    tar exit status 1 (files changed while being read) is logged and tolerated.
+    """
+    tmp_path = archive_path + ".tmp"
+    try:
+        if _PIGZ:
+            with open(tmp_path, "wb") as out_f, tempfile.TemporaryFile() as tar_err:
+                tar_proc = subprocess.Popen([_TAR, "-b", str(BACKUP_TAR_BLOCKING_FACTOR), "-cf", "-", *member_args], stdout=subprocess.PIPE, stderr=tar_err)
+                try:
+                    pigz_proc = subprocess.Popen([_PIGZ, f"-{BACKUP_GZIP_LEVEL}"], stdin=tar_proc.stdout, stdout=out_f, stderr=subprocess.PIPE)
+                except Exception:
+                    # Do not leave the already started tar behind as an orphan/zombie
+                    tar_proc.stdout.close()
+                    tar_proc.kill()
+                    tar_proc.wait()
+                    raise
+                # Drop our copy of the pipe so tar sees EPIPE if pigz exits early
+                tar_proc.stdout.close()
+                _, pigz_err = pigz_proc.communicate()
+                tar_proc.wait()
+                tar_err.seek(0)
+                tar_stderr = tar_err.read()
+                if tar_proc.returncode not in (0, 1) or pigz_proc.returncode != 0:
+                    stderr_text = (tar_stderr + pigz_err).decode(errors="replace").strip()
+                    error_message = f"Tar command failed. RC: tar={tar_proc.returncode}, pigz={pigz_proc.returncode}. Stderr: {stderr_text}"
+                    logger.error(error_message)
+                    raise Exception(error_message)
+                if tar_proc.returncode == 1:
+                    logger.warning(f"Some files changed while being archived: {tar_stderr.decode(errors='replace').strip()}")
+                os.fsync(out_f.fileno())
+        else:
+            tar_process_result = subprocess.run([_TAR, "-b", str(BACKUP_TAR_BLOCKING_FACTOR), "-I", f"gzip -{BACKUP_GZIP_LEVEL}", "-cf", tmp_path, *member_args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if tar_process_result.returncode not in (0, 1):
+                error_message = f"Tar command failed. RC: {tar_process_result.returncode}. Stderr: {tar_process_result.stderr.strip()}"
+                logger.error(error_message)
+                raise Exception(error_message)
+            if tar_process_result.returncode == 1:
+                logger.warning(f"Some files changed while being archived: {tar_process_result.stderr.strip()}")
+            _fsync_path(tmp_path)
+        os.replace(tmp_path, archive_path)
+        _fsync_path(os.path.dirname(archive_path) or ".")
     except Exception:
-        # Best-effort; if estimation fails, return 0 so we don't block backup incorrectly
-        return 0
-    return total_bytes
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
 def run_setting_backup(progress_callback=None, complete_callback=None):
     """
@@ -437,7 +1000,7 @@ def run_setting_backup(progress_callback=None, complete_callback=None):
     try:
         backup_base_path = _get_backup_path()
     except Exception as e:
-        logging.error(f"Failed to determine backup path: {e}")
+        logger.error(f"Failed to determine backup path: {e}")
         if complete_callback:
             complete_callback(False, str(e))
         return
@@ -447,67 +1010,40 @@ def run_setting_backup(progress_callback=None, complete_callback=None):
     original_service_states = {}
     backup_archive_created = False
 
-    def _call_progress(percent, message):
-        logging.info(f"Backup progress ({percent}%): {message}")
+    def _call_progress(percent, message, *args):
+        # Format lazily: nothing to do when INFO is filtered and no callback is attached
+        if not progress_callback and not logger.isEnabledFor(logging.INFO):
+            return
+        if args:
+            message = message % args
+        logger.info("Backup progress (%s%%): %s", percent, message)
         if progress_callback:
             progress_callback(percent, message)
 
     try:
-        _call_progress(0, f"Starting system settings backup using {BACKUP_STORAGE_MODE} storage.")
+        _call_progress(0, "Starting system settings backup using %s storage.", BACKUP_STORAGE_MODE)
 
         _call_progress(5, "Checking and stopping services.")
-        current_progress = 5
-        progress_per_service_stop = 25 / len(SERVICES_TO_MANAGE) if SERVICES_TO_MANAGE else 0
+        original_service_states = _query_service_states(SERVICES_TO_MANAGE)
+        active_services = [service for service, state in original_service_states.items() if state["active"]]
+        for service in SERVICES_TO_MANAGE:
+            if service not in active_services:
+                logger.info(f"Service {service} is not active.")
+        _call_progress(10, "Service states checked.")
 
-        for i, service in enumerate(SERVICES_TO_MANAGE):
-            service_active = False
-            service_enabled = False
-            try:
-                # Check if service is active
-                result = subprocess.run(["systemctl", "is-active", "--quiet", service])
-                service_active = result.returncode == 0
-                
-                # Check if service is enabled
-                result = subprocess.run(["systemctl", "is-enabled", "--quiet", service])
-                service_enabled = result.returncode == 0
-            except Exception as e:
-                logging.warning(f"Could not determine status of service {service}: {e}. Assuming inactive and disabled.")
-            
-            # Store both active and enabled status
-            original_service_states[service] = {
-                "active": service_active,
-                "enabled": service_enabled
-            }
-            
-            if service_active:
-                try:
-                    logging.info(f"Service {service} is active. Stopping it.")
-                    stop_result = subprocess.run(["systemctl", "stop", service], check=False, capture_output=True, text=True)
-                    if stop_result.returncode == 0:
-                        logging.info(f"Service {service} stopped successfully.")
-                    else:
-                        # systemctl stop returns 5 if service was not running, which is fine.
-                        if stop_result.returncode == 5:
-                             logging.info(f"Service {service} was already stopped or not found (rc=5).")
-                        else:
-                            logging.warning(f"Failed to stop service {service}. RC: {stop_result.returncode}. Error: {stop_result.stderr.strip()}. Proceeding.")
-                except Exception as e:
-                    logging.warning(f"Error stopping service {service}: {e}. Proceeding.")
-            else:
-                logging.info(f"Service {service} is not active.")
-            current_progress += progress_per_service_stop
-            _call_progress(int(current_progress), f"Processed service {service}.")
+        _stop_services(active_services)
+        _call_progress(28, "Processed services: %s.", ", ".join(SERVICES_TO_MANAGE))
 
         # Sync data to disk after stopping all services, repeat 3 times
         _call_progress(29, "Syncing filesystem after stopping services...")
         try:
             for i in range(3):
-                logging.info(f"Sync operation {i+1}/3")
-                subprocess.run(["sync"], check=False, capture_output=True, text=True)
+                logger.info(f"Sync operation {i+1}/3")
+                subprocess.run(["sync"], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                 time.sleep(1)
-            logging.info("Filesystem sync completed (3 times)")
+            logger.info("Filesystem sync completed (3 times)")
         except Exception as e:
-            logging.warning(f"Error during filesystem sync: {e}")
+            logger.warning(f"Error during filesystem sync: {e}")
 
         _call_progress(30, "Preparing to create backup archive.")
 
@@ -515,209 +1051,169 @@ def run_setting_backup(progress_callback=None, complete_callback=None):
         if BACKUP_STORAGE_MODE == "external" and not os.path.exists(backup_base_path):
             try:
                 os.makedirs(backup_base_path, exist_ok=True)
-                logging.info(f"Created external backup directory: {backup_base_path}")
+                logger.info(f"Created external backup directory: {backup_base_path}")
             except Exception as e:
                 error_msg = f"Failed to create external backup directory {backup_base_path}: {e}"
-                logging.error(error_msg)
+                logger.error(error_msg)
                 raise Exception(error_msg)
         else:
             os.makedirs(backup_base_path, exist_ok=True)
         
-        _call_progress(35, f"Ensured backup directory {backup_base_path} exists.")
+        _call_progress(35, "Ensured backup directory %s exists.", backup_base_path)
 
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        timestamp = time.strftime("%Y%m%d%H%M%S")
         backup_filename = f"setting_{timestamp}.tar.gz"
         backup_filepath = os.path.join(backup_base_path, backup_filename)
         
-        valid_backup_dirs = []
-        for path, _ in BACKUP_DIRS_CONFIG:
-            if os.path.exists(path):
-                valid_backup_dirs.append(path)
-            else:
-                logging.warning(f"Backup source directory {path} does not exist. Skipping.")
-        
-        if not valid_backup_dirs:
-            logging.error("No valid source directories found for backup. Aborting backup creation.")
+        existing_sources = _existing_paths(path for path, _ in BACKUP_DIRS_CONFIG)
+        if not existing_sources:
+            logger.error("No valid source directories found for backup. Aborting backup creation.")
             raise Exception("No valid source directories found for backup.")
 
-        # --- New packaging process (with file cleanup) ---
-        import tempfile
+        # --- Packaging process: tar reads the source directories in place ---
         _call_progress(37, "Preparing temporary directory for backup.")
         
-        total_cleaned_files = 0
-        total_cleaned_size = 0
-        
         # Prefer dedicated cache dir to avoid /tmp space constraint
         temp_base_dir = "/var/cache/thirdreality"
         try:
-            if not os.path.exists(temp_base_dir):
-                os.makedirs(temp_base_dir, exist_ok=True)
+            os.makedirs(temp_base_dir, exist_ok=True)
         except Exception as e:
-            logging.warning(f"Failed to ensure temp base dir {temp_base_dir}: {e}. Falling back to default tmp.")
+            logger.warning(f"Failed to ensure temp base dir {temp_base_dir}: {e}. Falling back to default tmp.")
             temp_base_dir = None
 
-        # Preflight: estimate required bytes and compare with available free space
+        # Walk each source once: the member lists feed tar and their sizes the space check
+        collected_sources = []
+        estimated_bytes = 0
+        total_cleaned_files = 0
+        total_cleaned_size = 0
+        for src_path, name in BACKUP_DIRS_CONFIG:
+            if src_path not in existing_sources:
+                logger.warning(f"Backup source directory {src_path} does not exist. Skipping.")
+                continue
+            members, included_size, cleaned_count, cleaned_size = _collect_backup_members(src_path, BACKUP_EXCLUDE_PATTERNS)
+            estimated_bytes += included_size
+            total_cleaned_files += cleaned_count
+            total_cleaned_size += cleaned_size
+            logger.info(f"{src_path}: {len(members)} entries to archive, {cleaned_count} files excluded ({cleaned_size} bytes saved)")
+            collected_sources.append((src_path, name, members))
+
+        # Preflight: compare the collected size with free space on the target filesystem
         try:
-            estimated_bytes = _estimate_backup_size_bytes(BACKUP_DIRS_CONFIG, BACKUP_EXCLUDE_PATTERNS)
-            # Add 64MB headroom for metadata/tar overhead
-            estimated_with_overhead = estimated_bytes + 64 * 1024 * 1024
-            check_dir = temp_base_dir if temp_base_dir else tempfile.gettempdir()
-            usage = shutil.disk_usage(check_dir)
+            # Tar size roughly <= source size; require at least estimated+32MB in target
+            estimated_with_overhead = estimated_bytes + 32 * 1024 * 1024
+            usage = shutil.disk_usage(backup_base_path)
             free_bytes = usage.free
-            if estimated_with_overhead > 0 and free_bytes < estimated_with_overhead:
-                msg = (f"Insufficient space for backup temp dir: need ~{estimated_with_overhead/1024/1024:.1f} MB, "
-                       f"free {free_bytes/1024/1024:.1f} MB at {check_dir}")
-                logging.error(msg)
+            if estimated_bytes > 0 and free_bytes < estimated_with_overhead:
+                msg = (f"Insufficient space on target filesystem for backup archive: need ~{estimated_with_overhead/1024/1024:.1f} MB, "
+                       f"free {free_bytes/1024/1024:.1f} MB at {backup_base_path}")
+                logger.error(msg)
                 raise Exception(msg)
         except Exception as e_space:
-            logging.error(f"Preflight space check failed: {e_space}")
+            logger.error(f"Preflight space check failed: {e_space}")
             if complete_callback:
                 complete_callback(False, str(e_space))
             return
 
+        # The temporary directory only holds the state files, the member list and,
+        # if it has to be purged, a copy of the Home Assistant database
         with tempfile.TemporaryDirectory(prefix="setting_backup_", dir=temp_base_dir) as temp_backup_dir:
-            # 1. Copy all directories to be backed up to temp directory (excluding unwanted files)
-            for src_path, name in BACKUP_DIRS_CONFIG:
-                if os.path.exists(src_path):
-                    dest_path = os.path.join(temp_backup_dir, name)
-                    if os.path.isdir(src_path):
-                        # Use new cleanup function to copy directory
-                        # Runtime free-space check before heavy copy
-                        try:
-                            usage_now = shutil.disk_usage(temp_backup_dir)
-                            # Require at least 16MB free headroom to continue
-                            if usage_now.free < 16 * 1024 * 1024:
-                                raise Exception("Insufficient space during backup copy phase (dir)")
-                        except Exception as e:
-                            logging.error(str(e))
-                            raise
-                        cleaned_count, cleaned_size = _clean_directory_for_backup(src_path, dest_path, BACKUP_EXCLUDE_PATTERNS)
-                        total_cleaned_files += cleaned_count
-                        total_cleaned_size += cleaned_size
-                        logger.info(f"Directory {src_path} copied to backup with {cleaned_count} files excluded ({cleaned_size} bytes saved)")
-                    elif os.path.isfile(src_path):
-                        # Check if single file should be excluded
-                        if not _should_exclude_file(os.path.basename(src_path), BACKUP_EXCLUDE_PATTERNS):
-                            # Runtime free-space check for file copy
-                            try:
-                                usage_now = shutil.disk_usage(temp_backup_dir)
-                                need = os.path.getsize(src_path) + 8 * 1024 * 1024  # +8MB margin
-                                if usage_now.free < need:
-                                    raise Exception("Insufficient space during backup copy phase (file)")
-                            except Exception as e:
-                                logging.error(str(e))
-                                raise
-                            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                            shutil.copy2(src_path, dest_path)
-                        else:
-                            file_size = os.path.getsize(src_path)
-                            total_cleaned_files += 1
-                            total_cleaned_size += file_size
-                            logger.info(f"File {src_path} excluded from backup ({file_size} bytes saved)")
-            
-            if total_cleaned_files > 0:
-                logger.info(f"Backup cleanup summary: {total_cleaned_files} files excluded, {total_cleaned_size / 1024 / 1024:.2f} MB saved")
-                _call_progress(39, f"File cleanup completed: {total_cleaned_files} files excluded, {total_cleaned_size / 1024 / 1024:.2f} MB saved")
-            
-            # 1.5. Check and clean up Home Assistant database in temp directory if too large
+            # Members added from the temp directory, and source files they replace
+            extra_members = []
+            skip_paths = set()
+
+            # 1. Check and clean up a copy of the Home Assistant database if too large
             try:
-                ha_db_in_temp = os.path.join(temp_backup_dir, "homeassistant_data", "homeassistant", "home-assistant_v2.db")
+                ha_source = next((path for path, name in BACKUP_DIRS_CONFIG if name == "homeassistant_data"), None)
+                ha_db_path = os.path.join(ha_source, "homeassistant", "home-assistant_v2.db") if ha_source else None
+                ha_db_member = os.path.join("homeassistant_data", "homeassistant", "home-assistant_v2.db")
                 size_threshold_bytes = 100 * 1024 * 1024  # 100MB
-                if os.path.exists(ha_db_in_temp):
-                    db_size = os.path.getsize(ha_db_in_temp)
+                if ha_db_path and os.path.isfile(ha_db_path):
+                    db_stat = os.stat(ha_db_path)
+                    db_size = db_stat.st_size
                     if db_size > size_threshold_bytes:
-                        logging.warning(f"Home Assistant DB copy size {db_size/1024/1024:.2f}MB exceeds 100MB. Purging temporary DB copy...")
-                        _call_progress(39.5, "Purging Home Assistant database copy in temp directory...")
+                        logger.warning(f"Home Assistant DB size {db_size/1024/1024:.2f}MB exceeds 100MB. Purging temporary DB copy...")
+                        # Require room for a full-size copy plus 8MB headroom; the purged copy is smaller
+                        if shutil.disk_usage(temp_backup_dir).free < db_size + 8 * 1024 * 1024:
+                            raise Exception("Insufficient space in temp directory for Home Assistant DB copy")
+                        ha_db_in_temp = os.path.join(temp_backup_dir, ha_db_member)
+                        os.makedirs(os.path.dirname(ha_db_in_temp), exist_ok=True)
+                        _call_progress(38.5, "Writing purged Home Assistant database copy to temp directory...")
                         try:
-                            # Connect and cleanup the copy in temp directory
-                            conn = sqlite3.connect(ha_db_in_temp, timeout=30)
-                            conn.execute("PRAGMA journal_mode=WAL;")
-                            conn.execute("PRAGMA busy_timeout=30000;")
-                            cur = conn.cursor()
-                            # Purge all rows from history tables
-                            cur.execute("DELETE FROM events;")
-                            cur.execute("DELETE FROM states;")
-                            cur.execute("DELETE FROM statistics;")
-                            cur.execute("DELETE FROM statistics_short_term;")
-                            conn.commit()
-                            # Checkpoint WAL to reduce file size before VACUUM
-                            try:
-                                cur.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-                            except Exception:
-                                pass
-                            conn.commit()
-                            conn.close()
-                            # VACUUM to shrink the temporary database
-                            try:
-                                _call_progress(39.7, "VACUUM temporary database copy...")
-                                conn2 = sqlite3.connect(ha_db_in_temp, timeout=60)
-                                conn2.execute("VACUUM;")
-                                conn2.close()
-                            except Exception as e_vac:
-                                logging.warning(f"VACUUM failed on temp DB: {e_vac}")
-                            logging.info("Temporary Home Assistant database cleanup finished.")
+                            _write_purged_db_copy(ha_db_path, ha_db_in_temp)
+                            # tar records the copy's mode and owner, so carry over the original's
+                            os.chmod(ha_db_in_temp, db_stat.st_mode & 0o7777)
+                            os.chown(ha_db_in_temp, db_stat.st_uid, db_stat.st_gid)
+                            # Archive the copy in place of the original
+                            extra_members.append(ha_db_member)
+                            skip_paths.add(ha_db_path)
+                            purged_size = os.path.getsize(ha_db_in_temp)
+                            logger.info(f"Temporary Home Assistant database cleanup finished ({purged_size/1024/1024:.2f}MB).")
                         except Exception as e_db:
-                            logging.warning(f"Failed to cleanup temporary Home Assistant DB: {e_db}")
+                            # A partial copy is left out of the archive and removed with the temp directory
+                            logger.warning(f"Failed to cleanup temporary Home Assistant DB, archiving the original: {e_db}")
                     else:
-                        logging.info(f"Temporary Home Assistant DB copy under threshold ({db_size/1024/1024:.2f}MB); skipping cleanup.")
+                        logger.info(f"Home Assistant DB under threshold ({db_size/1024/1024:.2f}MB); skipping cleanup.")
             except Exception as e:
-                logging.warning(f"Error during temp DB cleanup stage: {e}")
+                logger.warning(f"Error during temp DB cleanup stage: {e}")
             
             # 2. Write service_states.json
             service_states_path = os.path.join(temp_backup_dir, "service_states.json")
             with open(service_states_path, 'w') as f:
-                json.dump(original_service_states, f, indent=2)
+                f.write(json.dumps(original_service_states, indent=2))
+            state_members = ["service_states.json"]
             # Collect and write network_states.json
             network_states = None
             try:
                 ssid, psk = get_current_wifi_info()
                 if ssid and psk:
-                    encrypted_psk = base64.b64encode(psk.encode()).decode()
-                    network_states = {"ssid": ssid, "psk": encrypted_psk}
+                    # base64 only obfuscates the psk: the archive must stay restorable after a
+                    # reflash (new machine-id), so it is not encrypted with a device-bound key
+                    encoded_psk = base64.b64encode(psk.encode()).decode("ascii")
+                    network_states = {"ssid": ssid, "psk": encoded_psk}
                     network_states_path = os.path.join(temp_backup_dir, "network_states.json")
                     with open(network_states_path, 'w') as f:
-                        json.dump(network_states, f, indent=2)
+                        f.write(json.dumps(network_states, indent=2))
+                    state_members.append("network_states.json")
                     logger.info(f"Network states saved: ssid={ssid}")
                 else:
                     logger.info("No WiFi connection info found, skipping network_states.json backup.")
             except Exception as e:
                 logger.warning(f"Failed to collect network states: {e}")
-            _call_progress(40, "All data copied to temp dir, creating tarball...")
-            # 3. Package entire temporary directory contents
-            # Extra space check before tar (target filesystem)
-            try:
-                target_dir = os.path.dirname(backup_filepath) or "."
-                usage_target = shutil.disk_usage(target_dir)
-                # Tar size roughly <= source size; require at least estimated+32MB in target
-                need_target = max(estimated_bytes, 0) + 32 * 1024 * 1024
-                if usage_target.free < need_target:
-                    raise Exception("Insufficient space on target filesystem for backup archive")
-            except Exception as e:
-                logging.error(str(e))
-                raise
-            tar_command = ["tar", "-czf", backup_filepath, "-C", temp_backup_dir, "."]
-            tar_process_result = subprocess.run(tar_command, capture_output=True, text=True)
-            if tar_process_result.returncode != 0:
-                error_message = f"Tar command failed. RC: {tar_process_result.returncode}. Stderr: {tar_process_result.stderr.strip()}"
-                logging.error(error_message)
-                raise Exception(error_message)
-            logging.info(f"Backup archive created successfully: {backup_filepath}")
-            # Force sync to flush NAND cache
-            force_sync()
-            logging.info("Force sync executed after backup archive creation.")
+
+            # 3. Write the collected source members and renaming rules
+            transform_args = []
+            member_list_path = os.path.join(temp_backup_dir, "members.lst")
+            with open(member_list_path, "wb") as member_list:
+                for src_path, name, members in collected_sources:
+                    # NUL-separated paths relative to / (read by tar with --null -T)
+                    for member in members:
+                        if member not in skip_paths:
+                            member_list.write(os.fsencode(member.lstrip("/")) + b"\0")
+                    transform_args.append(_tar_rename_expression(src_path, name))
+
+            if total_cleaned_files > 0:
+                logger.info(f"Backup cleanup summary: {total_cleaned_files} files excluded, {total_cleaned_size / 1024 / 1024:.2f} MB saved")
+                _call_progress(39, "File cleanup completed: %d files excluded, %.2f MB saved", total_cleaned_files, total_cleaned_size / 1024 / 1024)
+            _call_progress(40, "Backup contents collected, creating tarball...")
+
+            # 4. Package state files and source directories without an intermediate copy
+            member_args = ["--null", "--no-recursion", "--ignore-failed-read", *transform_args,
+                           "-C", temp_backup_dir, *state_members,
+                           "-C", "/", "-T", member_list_path]
+            if extra_members:
+                member_args += ["-C", temp_backup_dir, *extra_members]
+            _create_backup_archive(member_args, backup_filepath)
+            logger.info(f"Backup archive created successfully: {backup_filepath}")
             _call_progress(70, "Backup archive created.")
             backup_archive_created = True
 
         _call_progress(75, "Indexing backup files (no deletion).")
-        backup_files = sorted(
-            glob.glob(os.path.join(backup_base_path, "setting_*.tar.gz")),
-            key=os.path.getmtime
-        )
-        logging.info(f"Found {len(backup_files)} backup file(s). No rotation or deletion will be performed.")
+        backup_files = _list_backup_files(backup_base_path)
+        logger.info(f"Found {len(backup_files)} backup file(s). No rotation or deletion will be performed.")
         _call_progress(85, "Backup files indexed.")
 
     except Exception as e:
-        logging.error(f"System settings backup failed critically: {e}", exc_info=True)
+        logger.error(f"System settings backup failed critically: {e}", exc_info=True)
         if complete_callback:
             complete_callback(False, str(e) if str(e) else "Unknown error during backup")
     finally:
@@ -726,38 +1222,23 @@ def run_setting_backup(progress_callback=None, complete_callback=None):
             temp_service_state_file = os.path.join(backup_base_path, "service_states.json")
             if os.path.exists(temp_service_state_file):
                 os.remove(temp_service_state_file)
-                logging.info(f"Cleaned up temporary file: {temp_service_state_file}")
+                logger.info(f"Cleaned up temporary file: {temp_service_state_file}")
         except Exception as cleanup_error:
-            logging.warning(f"Failed to clean up temporary files: {cleanup_error}")
-        _call_progress(90, "Restoring services to their original states (if changed).")
-        current_progress = 90
-        progress_per_service_start = 10 / len(original_service_states) if original_service_states else 0
-
-        for i, (service, was_active) in enumerate(original_service_states.items()):
-            if was_active["active"]:
-                try:
-                    logging.info(f"Service {service} was originally active. Ensuring it is started.")
-                    start_result = subprocess.run(["systemctl", "start", service], check=False, capture_output=True, text=True)
-                    if start_result.returncode == 0:
-                        logging.info(f"Service {service} started successfully.")
-                    else:
-                        logging.warning(f"Failed to start service {service}. RC: {start_result.returncode}. Error: {start_result.stderr.strip()}")
-                except Exception as e_restart_other:
-                    logging.error(f"Unexpected error restarting service {service}: {e_restart_other}")
-            current_progress += progress_per_service_start
-            _call_progress(int(current_progress), f"Processed service restoration for {service}.")
-        
-        logging.info("Service restoration phase complete.")
-        
-        # Force sync to flush NAND cache after successful backup
-        force_sync()
-        logging.info("Force sync executed after successful backup completion.")
+            logger.warning(f"Failed to clean up temporary files: {cleanup_error}")
+        services_to_start = [service for service, state in original_service_states.items() if state["active"]]
+        if services_to_start:
+            _call_progress(90, "Restoring services to their original states (if changed).")
+            _start_services(services_to_start)
+            _call_progress(99, "Processed service restoration.")
+            logger.info("Service restoration phase complete.")
+        else:
+            logger.info("No services were active before backup; skipping service restoration.")
         
         # Create restore record for the backup to prevent auto-restore
         if backup_archive_created:
             backup_filename = os.path.basename(backup_filepath)
             _create_restore_record(backup_filename, True)
-            logging.info(f"Restore record created for backup {backup_filename} to prevent auto-restore")
+            logger.info(f"Restore record created for backup {backup_filename} to prevent auto-restore")
         
         # Call completion callback and final progress only after all work is done
         if complete_callback:
@@ -784,7 +1265,7 @@ def _get_restore_record_path(backup_filename):
     """
     # Extract timestamp from backup filename (setting_YYYYMMDDHHMMSS.tar.gz)
     if backup_filename.startswith("setting_") and backup_filename.endswith(".tar.gz"):
-        timestamp = backup_filename.replace("setting_", "").replace(".tar.gz", "")
+        timestamp = backup_filename[len("setting_"):-len(".tar.gz")]
         record_filename = f"restore_record_{timestamp}.json"
     else:
         # Fallback: use the full filename as identifier
@@ -793,22 +1274,23 @@ def _get_restore_record_path(backup_filename):
     
     return os.path.join(RESTORE_RECORD_DIR, record_filename)
 
-def _check_restore_record_exists(backup_filename):
+def _check_restore_record_exists(record_path):
     """
-    Check if restore record exists for the given backup file
+    Check if a restore record exists at record_path (see _get_restore_record_path)
     """
-    record_path = _get_restore_record_path(backup_filename)
-    return os.path.exists(record_path)
+    return os.path.lexists(record_path)
 
-def _create_restore_record(backup_filename, success=True):
+def _create_restore_record(backup_filename, success=True, record_path=None):
     """
     Create restore record file after successful restore
+    record_path defaults to _get_restore_record_path(backup_filename)
     """
     try:
         # Ensure record directory exists
         os.makedirs(RESTORE_RECORD_DIR, exist_ok=True)
         
-        record_path = _get_restore_record_path(backup_filename)
+        if record_path is None:
+            record_path = _get_restore_record_path(backup_filename)
         record_data = {
             "backup_filename": backup_filename,
             "restore_timestamp": datetime.now().isoformat(),
@@ -817,12 +1299,17 @@ def _create_restore_record(backup_filename, success=True):
         }
         
         with open(record_path, 'w') as f:
-            json.dump(record_data, f, indent=2)
+            # One write instead of json.dump's per-chunk writes
+            f.write(json.dumps(record_data, indent=2))
+            # Persist just this record (and its directory entry) rather than syncing every filesystem
+            f.flush()
+            os.fdatasync(f.fileno())
+        _fsync_path(RESTORE_RECORD_DIR)
         
-        logging.info(f"Restore record created: {record_path}")
+        logger.info(f"Restore record created: {record_path}")
         return True
     except Exception as e:
-        logging.error(f"Failed to create restore record: {e}")
+        logger.error(f"Failed to create restore record: {e}")
         return False
 
 def run_setting_restore(backup_file=None, progress_callback=None, complete_callback=None):
@@ -833,25 +1320,30 @@ def run_setting_restore(backup_file=None, progress_callback=None, complete_callb
     try:
         backup_base_path = _get_backup_path()
     except Exception as e:
-        logging.error(f"Failed to determine backup path: {e}")
+        logger.error(f"Failed to determine backup path: {e}")
         if complete_callback:
             complete_callback(False, str(e))
         return
     original_service_states = {}
     backup_service_states = {}
 
-    def _call_progress(percent, message):
-        logging.info(f"Restore progress ({percent}%): {message}")
+    def _call_progress(percent, message, *args):
+        # Format lazily: nothing to do when INFO is filtered and no callback is attached
+        if not progress_callback and not logger.isEnabledFor(logging.INFO):
+            return
+        if args:
+            message = message % args
+        logger.info("Restore progress (%s%%): %s", percent, message)
         if progress_callback:
             progress_callback(percent, message)
 
     try:
-        _call_progress(0, f"Starting system settings restore using {BACKUP_STORAGE_MODE} storage.")
+        _call_progress(0, "Starting system settings restore using %s storage.", BACKUP_STORAGE_MODE)
         
         # Check if backup directory exists for external storage
         if BACKUP_STORAGE_MODE == "external" and not os.path.exists(backup_base_path):
             error_msg = f"External backup directory {backup_base_path} does not exist"
-            logging.error(error_msg)
+            logger.error(error_msg)
             if complete_callback:
                 complete_callback(False, error_msg)
             _call_progress(100, "External backup directory not found.")
@@ -862,40 +1354,37 @@ def run_setting_restore(backup_file=None, progress_callback=None, complete_callb
         if backup_file:
             # Convert timestamp to full filename format
             full_backup_filename = f"setting_{backup_file}.tar.gz"
-            _call_progress(5, f"Checking for specified backup file: {full_backup_filename} (from timestamp: {backup_file})")
+            _call_progress(5, "Checking for specified backup file: %s (from timestamp: %s)", full_backup_filename, backup_file)
             candidate_filepath = os.path.join(backup_base_path, full_backup_filename)
             if os.path.isfile(candidate_filepath):
                 selected_backup_filepath = candidate_filepath
-                logging.info(f"Using specified backup file: {selected_backup_filepath}")
-                _call_progress(10, f"Specified backup file found: {full_backup_filename}")
+                logger.info(f"Using specified backup file: {selected_backup_filepath}")
+                _call_progress(10, "Specified backup file found: %s", full_backup_filename)
             else:
                 error_msg = f"Specified backup file {full_backup_filename} not found in backup directory {backup_base_path}"
-                logging.error(error_msg)
+                logger.error(error_msg)
                 if complete_callback:
                     complete_callback(False, error_msg)
                 _call_progress(100, "Specified backup file not found.")
                 return
         else:
             _call_progress(5, "No specific backup file provided. Scanning for existing backups.")
-            backup_files = sorted(
-                glob.glob(os.path.join(backup_base_path, "setting_*.tar.gz")),
-                key=os.path.getmtime,
-                reverse=True  # Get newest first
-            )
+            backup_files = _list_backup_files(backup_base_path)
             if backup_files:
-                selected_backup_filepath = backup_files[0]
-                logging.info(f"Using the latest backup file found: {selected_backup_filepath}")
-                _call_progress(10, f"Selected latest backup for restore: {os.path.basename(selected_backup_filepath)}")
+                # Newest backup by mtime, single pass without sorting
+                selected_backup_filepath = max(backup_files)[1]
+                logger.info(f"Using the latest backup file found: {selected_backup_filepath}")
+                _call_progress(10, "Selected latest backup for restore: %s", os.path.basename(selected_backup_filepath))
             else:
                 if BACKUP_STORAGE_MODE == "external":
                     error_msg = f"No backup files found in external storage directory {backup_base_path}"
-                    logging.error(error_msg)
+                    logger.error(error_msg)
                     if complete_callback:
                         complete_callback(False, error_msg)
                     _call_progress(100, "No backup files found in external storage.")
                     return
                 else:
-                    logging.info(f"No backup file specified and no 'setting_*.tar.gz' files found in {backup_base_path}. Concluding restore as per request.")
+                    logger.info(f"No backup file specified and no 'setting_*.tar.gz' files found in {backup_base_path}. Concluding restore as per request.")
                     if complete_callback:
                         complete_callback(True, "success - no backup files found to restore")
                     _call_progress(100, "No 'setting_*.tar.gz' backup files found to restore.")
@@ -903,196 +1392,144 @@ def run_setting_restore(backup_file=None, progress_callback=None, complete_callb
         
         # Check if restore record exists for the selected backup file
         backup_filename = os.path.basename(selected_backup_filepath)
-        if _check_restore_record_exists(backup_filename):
+        restore_record_path = _get_restore_record_path(backup_filename)
+        if _check_restore_record_exists(restore_record_path):
             error_msg = f"Restore record already exists for backup file {backup_filename}. This backup has already been restored. Restore operation cancelled."
-            logging.error(error_msg)
+            logger.error(error_msg)
             if complete_callback:
                 complete_callback(False, error_msg)
             _call_progress(100, "Restore cancelled - backup already restored.")
             return
 
-        _call_progress(12, f"No restore record found for {backup_filename}, proceeding with restore")
+        _call_progress(12, "No restore record found for %s, proceeding with restore", backup_filename)
 
-        with tempfile.TemporaryDirectory(prefix="restore_temp_") as temp_extraction_dir:
-            _call_progress(15, f"Created temporary directory for extraction: {temp_extraction_dir}")
-            logging.info(f"Extracting {selected_backup_filepath} to {temp_extraction_dir}")
-            tar_extract_command = ["tar", "-xzf", selected_backup_filepath, "-C", temp_extraction_dir]
-            extract_result = subprocess.run(tar_extract_command, capture_output=True, text=True)
-
-            if extract_result.returncode != 0:
-                error_msg = f"Failed to extract backup archive {selected_backup_filepath}. RC: {extract_result.returncode}. Stderr: {extract_result.stderr.strip()}"
-                logging.error(error_msg)
-                raise Exception(error_msg)
-            _call_progress(30, "Backup archive extracted successfully.")
+        _call_progress(15, "Extracting backup archive %s.", backup_filename)
+        logger.info(f"Extracting {selected_backup_filepath} next to the restore targets")
+        staged_targets, sidecars = _extract_backup_archive(selected_backup_filepath)
+        _call_progress(30, "Backup archive extracted successfully.")
 
-            # Try to read service states from backup
-            # Service state file is stored at the top level of the backup as service_states.json
-            service_state_file = os.path.join(temp_extraction_dir, "service_states.json")
-            if os.path.exists(service_state_file):
-                try:
-                    backup_service_states = json.load(open(service_state_file, 'r'))
-                    logging.info(f"Loaded service states from backup: {backup_service_states}")
-                    _call_progress(32, "Service states loaded from backup.")
-                except Exception as e:
-                    logging.warning(f"Failed to load service states from backup: {e}. Will use current service states for restore.")
-                    backup_service_states = {}
-            else:
-                logging.info("No service state file found in backup. Will use current service states for restore.")
+        # Try to read service states from backup
+        # Service state file is stored at the top level of the backup as service_states.json
+        if "service_states.json" in sidecars:
+            try:
+                backup_service_states = json.loads(sidecars["service_states.json"])
+                logger.info(f"Loaded service states from backup: {backup_service_states}")
+                _call_progress(32, "Service states loaded from backup.")
+            except Exception as e:
+                logger.warning(f"Failed to load service states from backup: {e}. Will use current service states for restore.")
                 backup_service_states = {}
+        else:
+            logger.info("No service state file found in backup. Will use current service states for restore.")
+            backup_service_states = {}
 
-            _call_progress(35, "Stopping all services prior to restore.")
-            current_progress_services = 35
-            progress_per_service_stop = 15 / len(SERVICES_TO_MANAGE) if SERVICES_TO_MANAGE else 0
+        _call_progress(35, "Stopping all services prior to restore.")
+        original_service_states = _query_service_states(SERVICES_TO_MANAGE)
+        _call_progress(40, "Service states checked.")
+        _stop_services([service for service, state in original_service_states.items() if state["active"]])
+        _call_progress(50, "Service stopping phase complete.")
 
-            for service in SERVICES_TO_MANAGE:
-                service_active = False
-                service_enabled = False
+        _call_progress(55, "Starting data restoration from extracted backup.")
+        for i, (target_sys_path, staging_path) in enumerate(staged_targets):
+            try:
+                old_path = target_sys_path + ".bak"
                 try:
-                    result = subprocess.run(["systemctl", "is-active", "--quiet", service])
-                    service_active = result.returncode == 0
-                    
-                    result = subprocess.run(["systemctl", "is-enabled", "--quiet", service])
-                    service_enabled = result.returncode == 0
-                except Exception as e_stat:
-                    logging.warning(f"Could not determine status of service {service}: {e_stat}. Assuming inactive and disabled.")
-                original_service_states[service] = {
-                    "active": service_active,
-                    "enabled": service_enabled
-                }
-                if service_active:
+                    os.rename(target_sys_path, old_path)
+                    logger.info(f"Replacing existing content at {target_sys_path}.")
+                except FileNotFoundError:
+                    old_path = None
+                os.rename(staging_path, target_sys_path)
+                if old_path:
+                    # The swap is committed; delete the old tree now so no half-deleted .bak
+                    # outlives this restore or races the cleanup of the next one
                     try:
-                        logging.info(f"Service {service} is active. Stopping it for restore.")
-                        stop_result = subprocess.run(["systemctl", "stop", service], check=False, capture_output=True, text=True)
-                        if stop_result.returncode == 0 or stop_result.returncode == 5: # 0=stopped, 5=not running
-                            logging.info(f"Service {service} stopped or was not running.")
-                        else:
-                            logging.warning(f"Failed to stop service {service}. RC: {stop_result.returncode}. Error: {stop_result.stderr.strip()}. Proceeding with caution.")
-                    except Exception as e_stop:
-                        logging.warning(f"Error stopping service {service}: {e_stop}. Proceeding with caution.")
-                current_progress_services += progress_per_service_stop
-                _call_progress(int(current_progress_services), f"Processed service {service} for stopping.")
-            _call_progress(50, "Service stopping phase complete.")
-
-            _call_progress(55, "Starting data restoration from extracted backup.")
-            current_progress_data = 55
-            progress_per_dir_restore = 25 / len(BACKUP_DIRS_CONFIG) if BACKUP_DIRS_CONFIG else 0
-
-            for target_sys_path, mapped_name in BACKUP_DIRS_CONFIG:
-                target_sys_path = os.path.normpath(target_sys_path)
-                source_in_temp = os.path.join(temp_extraction_dir, mapped_name)
-                _call_progress(int(current_progress_data), f"Restoring data for {target_sys_path}")
-                if os.path.exists(source_in_temp):
-                    logging.info(f"Source {source_in_temp} found in backup. Restoring to {target_sys_path}.")
+                        _remove_path(old_path)
+                    except OSError as e_cleanup:
+                        logger.warning(f"Failed to remove previous content {old_path}: {e_cleanup}")
+                logger.info(f"Successfully restored {target_sys_path}.")
+            except Exception as e_restore_item:
+                logger.error(f"Failed to restore {target_sys_path} from {staging_path}: {e_restore_item}", exc_info=True)
+                if old_path and os.path.lexists(old_path) and not os.path.lexists(target_sys_path):
+                    # Put the previous content back rather than leave the target missing
                     try:
-                        parent_of_target = os.path.dirname(target_sys_path)
-                        if parent_of_target and not os.path.exists(parent_of_target):
-                            os.makedirs(parent_of_target, exist_ok=True)
-                        if os.path.exists(target_sys_path):
-                            logging.info(f"Removing existing content at {target_sys_path} before restore.")
-                            if os.path.isdir(target_sys_path):
-                                shutil.rmtree(target_sys_path)
-                            else:
-                                os.remove(target_sys_path)
-                        if os.path.isdir(source_in_temp):
-                            shutil.copytree(source_in_temp, target_sys_path, symlinks=True)
-                        elif os.path.isfile(source_in_temp):
-                            os.makedirs(os.path.dirname(target_sys_path), exist_ok=True)
-                            shutil.copy2(source_in_temp, target_sys_path)
-                        else:
-                            logging.warning(f"Source {source_in_temp} is neither a file nor a directory. Skipping restore for {target_sys_path}.")
-                            current_progress_data += progress_per_dir_restore
-                            _call_progress(int(current_progress_data), f"Skipped non-file/dir source for {target_sys_path}.")
-                            continue
-                        logging.info(f"Successfully restored {target_sys_path}.")
-                    except Exception as e_restore_item:
-                        logging.error(f"Failed to restore {target_sys_path} from {source_in_temp}: {e_restore_item}", exc_info=True)
-                        raise Exception(f"Critical error during restore of {target_sys_path}: {e_restore_item}")
-                else:
-                    logging.warning(f"Source path {source_in_temp} not found in extracted backup. Skipping restore for {target_sys_path}.")
-                current_progress_data += progress_per_dir_restore
-                _call_progress(int(current_progress_data), f"Finished processing restore for {target_sys_path}.")
-            
-            _call_progress(80, "Data restoration phase complete.")
-            # Force sync to flush NAND cache after data restoration
-
-            logging.info("Update zigbee information ...")
-            if os.path.exists("/srv/homeassistant/bin/home_assistant_zigbee_fix.sh"):
-                if os.path.exists("/var/lib/homeassistant/zha.conf"):
-                    os.remove("/var/lib/homeassistant/zha.conf")
-                subprocess.run(["/srv/homeassistant/bin/home_assistant_zigbee_fix.sh"], capture_output=True, text=True)
-            else:
-                logging.warning("No homeassistant zigbee fix.sh found, skipping zigbee default config update.")
+                        os.rename(old_path, target_sys_path)
+                        logger.info(f"Rolled back {target_sys_path} to its previous content.")
+                    except Exception as e_rollback:
+                        logger.error(f"Failed to roll back {target_sys_path} from {old_path}: {e_rollback}")
+                for _, remaining_staging_path in staged_targets:
+                    _remove_path(remaining_staging_path)
+                raise Exception(f"Critical error during restore of {target_sys_path}: {e_restore_item}")
+            _call_progress(55 + 25 * (i + 1) // len(staged_targets), "Finished processing restore for %s.", target_sys_path)
+        
+        _call_progress(80, "Data restoration phase complete.")
+        # Force sync to flush NAND cache after data restoration
 
-            logging.info("Force sync executed after data restoration.")
-            force_sync()
-            # Restore network connection
+        logger.info("Update zigbee information ...")
+        if os.path.exists("/srv/homeassistant/bin/home_assistant_zigbee_fix.sh"):
             try:
-                network_states_path = os.path.join(temp_extraction_dir, "network_states.json")
-                network_states = None
-                if os.path.exists(network_states_path):
-                    with open(network_states_path, 'r') as f:
-                        network_states = json.load(f)
-                if network_states:
-                    ssid = network_states.get("ssid")
-                    encrypted_psk = network_states.get("psk")
-                    if ssid and encrypted_psk:
-                        psk = base64.b64decode(encrypted_psk.encode()).decode()
-                        # Check current connection
-                        current_ssid, _ = get_current_wifi_info()
-                        if current_ssid == ssid:
-                            logger.info("Current SSID matches saved SSID, skipping network restore.")
-                        else:
+                os.remove("/var/lib/homeassistant/zha.conf")
+            except FileNotFoundError:
+                pass
+            subprocess.run(["/srv/homeassistant/bin/home_assistant_zigbee_fix.sh"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            logger.warning("No homeassistant zigbee fix.sh found, skipping zigbee default config update.")
+
+        # Flush only the filesystems that received restored data
+        _sync_filesystems([target_sys_path for target_sys_path, _ in staged_targets])
+        logger.info("Sync executed after data restoration.")
+        # Restore network connection
+        try:
+            network_states = None
+            if "network_states.json" in sidecars:
+                network_states = json.loads(sidecars["network_states.json"])
+            if network_states:
+                ssid = network_states.get("ssid")
+                encoded_psk = network_states.get("psk")
+                if ssid and encoded_psk:
+                    # Check current connection before decoding the psk
+                    current_ssid, _ = get_current_wifi_info()
+                    if current_ssid == ssid:
+                        logger.info("Current SSID matches saved SSID, skipping network restore.")
+                    else:
+                        try:
+                            psk = base64.b64decode(encoded_psk).decode()
+                        except ValueError as e:
+                            psk = None
+                            logger.warning(f"Invalid psk in network_states.json, skipping network restore: {e}")
+                        if psk:
                             cmd = ["nmcli", "device", "wifi", "connect", ssid, "password", psk]
-                            result = subprocess.run(cmd, capture_output=True, text=True)
+                            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
                             if result.returncode == 0:
                                 logger.info(f"Successfully restored network connection to {ssid}")
                             else:
                                 logger.warning(f"Failed to restore network connection: {result.stderr}")
-                    else:
-                        logger.info("network_states.json missing ssid or psk, skipping network restore.")
                 else:
-                    logger.info("No network_states.json found, skipping network restore.")
-            except Exception as e:
-                logger.warning(f"Failed to restore network connection: {e}")
+                    logger.info("network_states.json missing ssid or psk, skipping network restore.")
+            else:
+                logger.info("No network_states.json found, skipping network restore.")
+        except Exception as e:
+            logger.warning(f"Failed to restore network connection: {e}")
 
     except Exception as e:
-        logging.error(f"System settings restore failed: {e}", exc_info=True)
+        logger.error(f"System settings restore failed: {e}", exc_info=True)
         if complete_callback:
             complete_callback(False, str(e) if str(e) else "Unknown error during restore")
     finally:
         if original_service_states: # Only proceed if services were actually stopped
             _call_progress(85, "Restoring services based on backup service states.")
-            current_progress_finally = 85
             
             # Use backup service states if available, otherwise fall back to original states
             service_states_to_restore = backup_service_states if backup_service_states else original_service_states
-            progress_per_service_start = 15 / len(service_states_to_restore) if service_states_to_restore else 0
+            # Sort services into batches so enable, disable and start each take one call
+            services_to_enable = []
+            services_to_disable = []
+            services_to_start = []
 
             for service, service_state in service_states_to_restore.items():
                 # Special handling: mosquitto must be enabled and started regardless of backup/original state
                 if service == "mosquitto.service":
-                    try:
-                        logging.info("Forcing mosquitto.service to be enabled after restore.")
-                        enable_result = subprocess.run(["systemctl", "enable", service], check=False, capture_output=True, text=True)
-                        if enable_result.returncode == 0:
-                            logging.info("mosquitto.service enabled successfully (post-restore).")
-                        else:
-                            logging.warning(f"Failed to enable mosquitto.service post-restore. RC: {enable_result.returncode}. Error: {enable_result.stderr.strip()}")
-                    except Exception as e_m_enable:
-                        logging.warning(f"Exception enabling mosquitto.service post-restore: {e_m_enable}")
-
-                    try:
-                        logging.info("Starting mosquitto.service after restore.")
-                        start_result = subprocess.run(["systemctl", "start", service], check=False, capture_output=True, text=True)
-                        if start_result.returncode == 0:
-                            logging.info("mosquitto.service started successfully (post-restore).")
-                        else:
-                            logging.warning(f"Failed to start mosquitto.service post-restore. RC: {start_result.returncode}. Error: {start_result.stderr.strip()}")
-                    except Exception as e_m_start:
-                        logging.warning(f"Exception starting mosquitto.service post-restore: {e_m_start}")
-
-                    current_progress_finally += progress_per_service_start
-                    _call_progress(int(min(current_progress_finally,100)), f"Processed service restoration for {service} (forced enable/start).")
+                    logger.info("Forcing mosquitto.service to be enabled and started after restore.")
+                    services_to_enable.append(service)
+                    services_to_start.append(service)
                     continue
                 # Handle both old format (boolean) and new format (dict) for backward compatibility
                 if isinstance(service_state, bool):
@@ -1106,52 +1543,48 @@ def run_setting_restore(backup_file=None, progress_callback=None, complete_callb
                 
                 # Restore enabled status if available
                 if should_be_enabled is not None:
-                    try:
-                        if should_be_enabled:
-                            logging.info(f"Service {service} should be enabled according to backup. Enabling it.")
-                            enable_result = subprocess.run(["systemctl", "enable", service], check=False, capture_output=True, text=True)
-                            if enable_result.returncode == 0:
-                                logging.info(f"Service {service} enabled successfully.")
-                            else:
-                                logging.warning(f"Failed to enable service {service} post-restore. RC: {enable_result.returncode}. Error: {enable_result.stderr.strip()}")
-                        else:
-                            logging.info(f"Service {service} should be disabled according to backup. Disabling it.")
-                            disable_result = subprocess.run(["systemctl", "disable", service], check=False, capture_output=True, text=True)
-                            if disable_result.returncode == 0:
-                                logging.info(f"Service {service} disabled successfully.")
-                            else:
-                                logging.warning(f"Failed to disable service {service} post-restore. RC: {disable_result.returncode}. Error: {disable_result.stderr.strip()}")
-                    except Exception as e_enable:
-                        logging.error(f"Unexpected error managing enabled status for service {service} post-restore: {e_enable}")
+                    if should_be_enabled:
+                        logger.info("Service %s should be enabled according to backup. Enabling it.", service)
+                        services_to_enable.append(service)
+                    else:
+                        logger.info("Service %s should be disabled according to backup. Disabling it.", service)
+                        services_to_disable.append(service)
                 
                 # Restore active status
                 if should_be_active:
-                    try:
-                        logging.info(f"Service {service} should be active according to backup. Starting it.")
-                        start_result = subprocess.run(["systemctl", "start", service], check=False, capture_output=True, text=True)
-                        if start_result.returncode == 0:
-                            logging.info(f"Service {service} started successfully.")
-                        else:
-                            logging.warning(f"Failed to start service {service} post-restore. RC: {start_result.returncode}. Error: {start_result.stderr.strip()}")
-                    except Exception as e_restart:
-                        logging.error(f"Unexpected error starting service {service} post-restore: {e_restart}")
+                    logger.info("Service %s should be active according to backup. Starting it.", service)
+                    services_to_start.append(service)
                 else:
-                    logging.info(f"Service {service} should remain inactive according to backup. Leaving it stopped.")
-                current_progress_finally += progress_per_service_start
-                _call_progress(int(min(current_progress_finally,100)), f"Processed service restoration for {service}.")
+                    logger.info("Service %s should remain inactive according to backup. Leaving it stopped.", service)
+
+            # original_service_states was read just before the services were stopped; skip
+            # enable/disable for units whose unit file state already matches
+            unchanged = [service for service in services_to_enable if original_service_states.get(service, {}).get("enabled")]
+            unchanged += [service for service in services_to_disable if not original_service_states.get(service, {}).get("enabled", True)]
+            if unchanged:
+                logger.info(f"Enabled state already matches for: {', '.join(unchanged)}")
+                services_to_enable = [service for service in services_to_enable if service not in unchanged]
+                services_to_disable = [service for service in services_to_disable if service not in unchanged]
+
+            # Services to enable and start are handled by one `enable --now` call
+            enable_and_start = [service for service in services_to_enable if service in services_to_start]
+            _call_progress(88, "Restoring enabled state of services.")
+            _set_services_enabled(enable_and_start, True, now=True)
+            _set_services_enabled([service for service in services_to_enable if service not in enable_and_start], True)
+            _set_services_enabled(services_to_disable, False)
+            start_only = [service for service in services_to_start if service not in enable_and_start]
+            if start_only:
+                _call_progress(94, "Starting services: %s.", ", ".join(start_only))
+                _start_services(start_only)
+            _call_progress(99, "Processed service restoration.")
             
             if backup_service_states:
-                logging.info("Service restoration based on backup service states complete.")
+                logger.info("Service restoration based on backup service states complete.")
             else:
-                logging.info("Service restoration based on current service states complete (no backup states found).")
+                logger.info("Service restoration based on current service states complete (no backup states found).")
             
             # Create restore record after successful restore
-            backup_filename = os.path.basename(selected_backup_filepath)
-            _create_restore_record(backup_filename, True)
-            
-            # Force sync to flush NAND cache after successful restore
-            force_sync()
-            logging.info("Force sync executed after successful restore completion.")
+            _create_restore_record(backup_filename, True, restore_record_path)
             
             # Call completion callback and final progress only after all work is done
             if complete_callback:
@@ -1160,8 +1593,8 @@ def run_setting_restore(backup_file=None, progress_callback=None, complete_callb
         else:
             # This case is hit if an early return occurred (e.g., no backup file found)
             # or if an error occurred before original_service_states was populated.
-            logging.info("No services were modified or an early exit occurred; skipping service restoration progress in 'finally' block.")
-        logging.info("Restore function 'finally' block finished execution.")
+            logger.info("No services were modified or an early exit occurred; skipping service restoration progress in 'finally' block.")
+        logger.info("Restore function 'finally' block finished execution.")
 
 def run_setting_local_restore(backup_file=None, progress_callback=None, complete_callback=None):
     """
@@ -1184,7 +1617,12 @@ def run_setting_updated(supervisor=None, progress_callback=None, complete_callba
         if progress_callback:
             progress_callback(0, "Starting version information cleanup...")
         
-        if not supervisor or not hasattr(supervisor, 'system_info'):
+        try:
+            system_info = supervisor.system_info
+        except AttributeError:
+            # Also covers supervisor=None
+            system_info = None
+        if system_info is None:
             error_msg = "Cannot access supervisor system_info"
             logger.error(error_msg)
             if complete_callback:
@@ -1195,8 +1633,8 @@ def run_setting_updated(supervisor=None, progress_callback=None, complete_callba
             progress_callback(20, "Clearing HomeAssistant version information...")
         
         # Clear HomeAssistant version information
-        if hasattr(supervisor.system_info, 'hainfo'):
-            ha_info = supervisor.system_info.hainfo
+        ha_info = getattr(system_info, 'hainfo', None)
+        if ha_info is not None:
             ha_info.config = ""
             ha_info.python = ""
             ha_info.core = ""
@@ -1211,8 +1649,8 @@ def run_setting_updated(supervisor=None, progress_callback=None, complete_callba
             progress_callback(60, "Clearing OpenHAB version information...")
         
         # Clear OpenHAB version information
-        if hasattr(supervisor.system_info, 'openhabinfo'):
-            openhab_info = supervisor.system_info.openhabinfo
+        openhab_info = getattr(system_info, 'openhabinfo', None)
+        if openhab_info is not None:
             openhab_info.version = ""
             # Reset installation status
             openhab_info.installed = False
@@ -1225,8 +1663,9 @@ def run_setting_updated(supervisor=None, progress_callback=None, complete_callba
         logger.info("Software update notification processed - all version information cleared")
         
         # Call SystemInfoUpdater to update software status and LED
-        if supervisor and hasattr(supervisor, 'sysinfo_update'):
-            supervisor.sysinfo_update.update_software_status_and_led()
+        sysinfo_update = getattr(supervisor, 'sysinfo_update', None)
+        if sysinfo_update is not None:
+            sysinfo_update.update_software_status_and_led()
         else:
             logger.warning("Supervisor missing sysinfo_update, cannot update software status and LED.")
         
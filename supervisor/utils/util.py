@@ -121,15 +121,12 @@ def is_service_present(service_name):
     Return True if the system has this service installed/known to systemd, regardless of running state.
     """
     try:
-        # systemctl status returns non-zero for inactive services, so do not check=True
-        result = subprocess.run(["systemctl", "status", service_name], capture_output=True, text=True)
-        # The output contains Loaded: loaded or could be not-found. Use that to determine presence.
-        stdout = (result.stdout or "") + "\n" + (result.stderr or "")
-        lowered = stdout.lower()
-        if "loaded: loaded" in lowered:
+        # LoadState alone tells whether systemd knows the unit; `systemctl status` would also read the journal
+        result = subprocess.run(["systemctl", "show", "--property=LoadState", "--value", service_name], capture_output=True, text=True)
+        load_state = (result.stdout or "").strip()
+        if load_state == "loaded":
             return True
-        # Some distros show 'could not be found' or 'not-found' when unit does not exist
-        if "not-found" in lowered or "could not be found" in lowered or "no such file" in lowered:
+        if load_state == "not-found":
             return False
         # Fallback: try list-unit-files which enumerates installed unit files
         list_result = subprocess.run(["systemctl", "list-unit-files", service_name], capture_output=True, text=True)
@@ -150,7 +147,8 @@ def is_service_enabled(service_name):
 
 def get_service_status(service_name):
     try:
-        result = subprocess.run(["systemctl", "status", service_name], capture_output=True, text=True)
+        # --lines=0 skips the journal excerpt, which is the slow part of `systemctl status`
+        result = subprocess.run(["systemctl", "status", "--lines=0", "--no-pager", service_name], capture_output=True, text=True)
         return result.stdout
     except Exception as e:
         logging.error(f"Error getting status for service {service_name}: {e}")